@@ -1,6 +1,8 @@
 # Adaptation of lattice covering code for APs (Arithmetic Progressions, i.e. resudue classes)
 
-from sage.all import ZZ, LCM, GCD, gcd, srange, Infinity
+from functools import reduce
+from math import gcd, lcm
+from sage.all import ZZ, srange, Infinity
 
 # Use [N,a] triples to encode a+NZ, displayed as <a;N>
 
@@ -32,6 +34,9 @@ class AP:
                 self.a = ZZ(a) % self.N
             else:
                 self.a = ZZ(a)
+        # Python int copies for the arithmetic in contains1()
+        self._N = None if N is None else int(self.N)
+        self._a = None if N is None else int(self.a)
 
     def __repr__(self):
         return f"<{self.a};{self.N}>"
@@ -55,9 +60,10 @@ class AP:
         """
         Return whether self contains integer x
         """
-        if self.N is None:
+        if self._N is None:
             return False
-        return self.N.divides(self.a-x)
+        t = self._a-x
+        return t % self._N == 0 if self._N else t == 0
 
     def contains(self, other):
         """
@@ -78,7 +84,7 @@ class AP:
         if self.is_trivial():
             return AP(0,x)
         else:
-            return AP(gcd(self.N, x - self.a), x)
+            return AP(gcd(int(self.N), int(x) - int(self.a)), x)
 
     def __hash__(self):
         return hash((self.N, self.a))
@@ -117,6 +123,58 @@ class AP:
 
 ############ end of definition of class AP ##########################################################
 
+class APSet:
+    r"""Class to store a list of genuine APs (with positive moduli)
+    which grows one AP at a time, together with:
+
+    mod_lcm, the lcm of the moduli;
+
+    coverage, a bytearray of length mod_lcm whose x'th entry is
+    nonzero iff x is in at least one of the APs.
+
+    Both are updated as each AP is added, so that testing whether the
+    APs cover Z does not need to start from scratch.  The functions
+    below which take a list of APs also accept an APSet.
+    """
+    def __init__(self, C=()):
+        self.items = []
+        self.mod_lcm = 1
+        self.coverage = bytearray(1)
+        for A in C:
+            self.add(A)
+
+    def __repr__(self):
+        return f"APSet({self.items})"
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def add(self, A):
+        """
+        Add one genuine AP A
+        """
+        M = lcm(self.mod_lcm, A._N)
+        if M != self.mod_lcm:
+            # x mod M is covered by the old APs iff x mod the old lcm is
+            self.coverage *= M // self.mod_lcm
+            self.mod_lcm = M
+        self.coverage[A._a::A._N] = b'\x01' * len(range(A._a, M, A._N))
+        self.items.append(A)
+
+    def covers(self):
+        """
+        Return whether the APs cover Z
+        """
+        return 0 not in self.coverage
+
+############ end of definition of class APSet #######################################################
+
 # Convention: A is one AP, C is a list of APs
 
 def moduli(C):
@@ -129,7 +187,9 @@ def modulus_lcm(C):
     """
     Return the lcm of of the moduli of the A in C
     """
-    return LCM(moduli(C))
+    if isinstance(C, APSet):
+        return C.mod_lcm
+    return reduce(lcm, (int(A.N) for A in C), 1)
 
 def weights(C):
     """
@@ -149,6 +209,27 @@ def is_in_union(x, C):
     """
     return any(A.contains1(x) for A in C)
 
+def covered_residues(C, M):
+    """
+    Return a bytearray of length M whose x'th entry is nonzero iff x
+    is in at least one of the APs A in the list C, all of which must
+    have modulus dividing M.
+    """
+    covered = bytearray(M)
+    for A in C:
+        step = A._N
+        start = A._a
+        covered[start::step] = b'\x01' * len(range(start, M, step))
+    return covered
+
+def residue_mask(M, A):
+    """
+    Return an int whose x'th bit, for 0<=x<M, is set iff x is in the
+    genuine AP A, whose modulus must divide M.
+    """
+    # sum(2^(A.a+k*A.N) for 0<=k<M/A.N)
+    return ((1 << M) - 1) // ((1 << A._N) - 1) << A._a
+
 def full_cover(N):
     """
     Return the full modulus N covering.
@@ -159,20 +240,26 @@ def isCover_rank2(C, debug=False):
     """
     Given a list of genuine APs, return whether they cover Z
     """
-    # Check the necessary condition that the weight is at least 1.
-    # The empty list has weight 0.
+    if isinstance(C, APSet):
+        return C.covers()
 
-    if weight(C) < 1:
-        return False
+    # Check the necessary condition that the weight is at least 1,
+    # i.e. that sum(N/A.N) >= N where N is the modulus lcm, using
+    # integers instead of rationals.  The empty list has weight 0.
 
-    # Check that every x mod N lies in at least one, where N is the modulus lcm
     N = modulus_lcm(C)
-    return all(is_in_union(x,C) for x in srange(N))
+    if sum(N // A._N for A in C) < N:
+        return False
+
+    # Check that every x mod N lies in at least one
+    return 0 not in covered_residues(C, N)
 
 def isCover(C, debug=False):
     """
     Given a list of APs, return whether they cover Z
     """
+    if isinstance(C, APSet):
+        return C.covers()
     return isCover_rank2([A for A in C if A.N])
 
 def isCover_without1(C, i, debug=False):
@@ -194,10 +281,38 @@ def isFull(C, check=False):
         return False
     return (not any(A.N==0 for A in C)) and (weight(C)==1 or not any(isCover_without1(C,i) for i in range(len(C))))
 
+def _set_bits(mask):
+    """
+    Return the list of i such that the i'th bit of the int mask is set.
+    """
+    ans = []
+    while mask:
+        low = mask & -mask
+        ans.append(low.bit_length()-1)
+        mask ^= low
+    return ans
+
+def _isOneMinimal(M, A, others):
+    """
+    Return True iff A, one of a list of APs which cover and whose
+    modulus lcm is M, cannot be replaced by a proper subAP, given the
+    bitmask others of the residues mod M in the other APs.
+    """
+    # any subAP must contain all these:
+    S = _set_bits(((1 << M) - 1) & ~others)
+    nS = len(S)
+    if nS==0: # A is completely redundant
+        return False
+    x = S[0]
+    D = reduce(gcd, (y-x for y in S[1:]), M)
+    # the smallest AP containing S is A(x;D)
+    return D==A.N
+
 def isOneMinimal(C, A):
     """
     Assuming that C covers, and A in C, return True iff A cannot be
-    replaced by a proper subAP.
+    replaced by a proper subAP.  The other APs are those in C not
+    equal to A.
     """
     # print(f"Checking {C} for minimality w.r.t. {A}")
     # First a quick check on the weight: replacing A by a proper
@@ -208,26 +323,40 @@ def isOneMinimal(C, A):
 
     # Now the full check.
     M = modulus_lcm(C)
-    # any subAP must contain all these:
-    S = [x for x in srange(M) if not any(A1!=A and A1.contains1(x) for A1 in C)]
-    nS = len(S)
-    if nS==0: # A is completely redundant
+    if M==0: # some AP in C is a singleton, so there are no residues to test
         return False
-    x = S[0]
-    D = GCD([M] + [x-y for y in S[1:]])
-    # the smallest AP containing S is A(x;D)
-    return D==A.N
+    others = 0
+    for A1 in C:
+        if A1!=A:
+            others |= residue_mask(M, A1)
+    return _isOneMinimal(M, A, others)
 
 def isMinimal(C, check=False):
     """
-    Assuming that C covers, return True iff C is minimal.
+    Assuming that C covers, return True iff C is minimal, i.e. iff
+    isOneMinimal(C, A) holds for all A in C.  As there, the APs other
+    than A exclude all those equal to A, so a repeated AP is not
+    treated as redundant.
 
     If check is True, first check that C covers.
     """
     # print(f"Checking {C} for minimality")
     if check and not isCover(C):
         return False
-    return all(isOneMinimal(C,A) for A in C)
+    # As in isOneMinimal() for each A in C, but computing the residues
+    # in the APs other than A as those in at least two distinct APs
+    # together with those in one AP but not in A:
+    w = weight(C)
+    M = modulus_lcm(C)
+    if M==0: # some AP in C is a singleton, as in isOneMinimal()
+        return False
+    masks = {A: residue_mask(M, A) for A in C} # one for each distinct A
+    once = twice = 0
+    for mask in masks.values():
+        twice |= once & mask
+        once |= mask
+    return all(A.weight() > 2*(w-1) or _isOneMinimal(M, A, twice | (once & ~mask))
+               for A, mask in masks.items())
 
 def isStronglyMinimal(C, check=False):
     """
@@ -235,8 +364,6 @@ def isStronglyMinimal(C, check=False):
 
     If check is True, first check that C covers.
     """
-    if check and not isCover(C):
-        return False
-    return all(isOneMinimal(C,A) for A in C)
+    return isMinimal(C, check)
 
 
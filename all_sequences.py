@@ -1,29 +1,77 @@
+from functools import lru_cache
 from sage.all import primes
 from refine_sequences import refine_sequence
 
-@cached_function
-def all_sequences(n, norepeats=True):
+def canonical_form(T):
+    """
+    Return a hashable canonical form of the nested sequence T: integers
+    are left as they are, while lists (and tuples) are replaced by
+    tuples whose entries are themselves in canonical form and sorted.
+
+    Two nested sequences which only differ in the order of their
+    entries (at any level) have the same canonical form.
+    """
+    if isinstance(T, (list, tuple)):
+        T = tuple(canonical_form(x) if isinstance(x, (list, tuple)) else x for x in T)
+    return _canon(T)
+
+@lru_cache(maxsize=None)
+def _canon(T):
+    # canonical_form(T) for T an integer or nested tuple, cached since
+    # the same subsequences occur many times, for different n
+    if isinstance(T, tuple):
+        return tuple(sorted((_canon(x) for x in T), key=_sort_key))
+    return int(T)
+
+def _sort_key(x):
+    # Integers sort before tuples; tuples are compared entrywise, so
+    # that mixed nested entries can always be compared.
+    if isinstance(x, tuple):
+        return (1, tuple(_sort_key(y) for y in x))
+    return (0, x)
+
+def _as_lists(T):
+    """
+    Convert a canonical form (nested tuples) back into nested lists.
+    """
+    if isinstance(T, tuple):
+        return [_as_lists(x) for x in T]
+    return T
+
+@lru_cache(maxsize=None)
+def _all_sequences(n, norepeats=True):
+    """
+    Cached version of all_sequences(), returning a tuple of canonical
+    forms (see canonical_form()) so that the cached values are
+    immutable.
+    """
     if n<=0:
-        return []
+        return ()
     if n==1:
-        return [[1]]
+        return ((1,),)
     ans = []
+    seen = set() # the same canonical forms as in ans
     for p in primes(n): ## all p < n
-        for S in all_sequences(n-p, norepeats):
+        for S in _all_sequences(n-p, norepeats):
             for T in refine_sequence(S, p, -1, norepeats):
-                try:
-                    T.sort()
-                except:
-                    pass
-                if T not in ans:
-                    ans.append(T)
-        for S in all_sequences(n-p+1, norepeats):
+                key = canonical_form(T)
+                if key not in seen:
+                    seen.add(key)
+                    ans.append(key)
+        for S in _all_sequences(n-p+1, norepeats):
             for T in refine_sequence(S, p, +1, norepeats):
-                try:
-                    T.sort()
-                except:
-                    pass
-                if T not in ans:
-                    ans.append(T)
-    print(f"all_sequences({n}) returns {ans}")
-    return ans #[T[0] for T in ans]
+                key = canonical_form(T)
+                if key not in seen:
+                    seen.add(key)
+                    ans.append(key)
+    return tuple(ans)
+
+def all_sequences(n, norepeats=True):
+    """
+    Return a list of all nested index sequences of size n, each in
+    canonical form (see canonical_form()) but as nested lists.
+    """
+    return [_as_lists(T) for T in _all_sequences(n, norepeats)]
+
+# Same interface as for a Sage cached_function:
+all_sequences.clear_cache = _all_sequences.cache_clear
@@ -3,8 +3,10 @@
 # This version does not use lattices explicitly, just [N,c,d] triples to
 # encode L(c:d;N).
 
-from sage.all import gcd, xgcd, GCD, LCM, ZZ, Infinity, cached_function
-from pvg import V, psi, P1, wedge
+from functools import reduce
+from math import gcd, lcm
+from sage.all import xgcd, ZZ, Infinity, cached_function
+from pvg import V, psi, P1, P1_ints, P1_index_map, P1_fibres, P1_fibre_masks, wedge
 
 class lattice:
     r"""Class to store a lattice (subgroup of ZZ^2), encoded as [N,c,d] where:
@@ -22,7 +24,7 @@ class lattice:
     itself.
 
     """
-    def __init__(self, N=0, c=None, d=None):
+    def __init__(self, N=0, c=None, d=None, *, _normalized=False):
         r"""
         Construct a lattice.
 
@@ -31,6 +33,8 @@ class lattice:
         - ``N`` -- a non-negative integer
 
         - ``c``, ``d`` -- either two integers, which are coprime, or both 0 when N=0; or id d is None, c should be a vector in ZZ^2 which is either primitive or 0.
+
+        - ``_normalized`` -- if True, (c,d) is known to be already normalized in P1(N), e.g. an element of P1(N).
         """
         self.N = ZZ(N)
         if N==0 and c is None:
@@ -42,11 +46,31 @@ class lattice:
                 self.c = ZZ(c)
                 self.d = ZZ(d)
         # we normalize on creation to make it faster to compute the
-        # index of (c:d) in P(N), needed for sorting (rank 2 only)
-        if N:
-            P1N = P1(N)
-            self.c, self.d = P1N.normalize(self.c, self.d)
-            self.P1_index = P1N.index_of_normalized_pair(self.c, self.d)
+        # index of (c:d) in P(N), needed for sorting (rank 2 only);
+        # the index itself is only computed when first used (see
+        # __getattr__())
+        if N and not _normalized:
+            self.c, self.d = P1(N).normalize(self.c, self.d)
+        # Python int copies for the arithmetic in contains1()
+        self._N, self._c, self._d = int(self.N), int(self.c), int(self.d)
+        # A key which determines the lattice, for hashing and equality:
+        # (c,d) is normalized in rank 2, and determined up to sign in
+        # rank 1.
+        if self._N:
+            self._key = (2, self._N, self._c, self._d)
+        elif self._c or self._d:
+            v = (self._c, self._d)
+            self._key = (1,) + (v if v > (0,0) else (-v[0], -v[1]))
+        else:
+            self._key = (0,)
+
+    def __getattr__(self, name):
+        # Only called when the attribute has not been set: compute and
+        # store the index of (c:d) in P(N) on first use.
+        if name == 'P1_index' and self._N:
+            self.P1_index = P1_index_map(self._N)[(self._c, self._d)]
+            return self.P1_index
+        raise AttributeError(name)
 
     def __repr__(self):
         return f"L({self.c}:{self.d};{self.N})"
@@ -61,21 +85,33 @@ class lattice:
         return (self.c, self.d)
 
     def basis(self):
+        # cached, as self is never changed after creation
+        try:
+            return self._basis
+        except AttributeError:
+            pass
         if self.is_trivial():
-            return []
-        v1 = self.v()
-        if self.N == 0:
-            return [v1]
-        g,x,y = xgcd(self.c, self.d)
-        assert g==1
-        v2 = (self.N*y,-self.N*x) # so the lattice basis is [v1,v2]
-        return [v1, v2]
+            B = []
+        elif self.N == 0:
+            B = [self.v()]
+        else:
+            v1 = self.v()
+            g,x,y = xgcd(self.c, self.d)
+            assert g==1
+            v2 = (self.N*y,-self.N*x) # so the lattice basis is [v1,v2]
+            B = [v1, v2]
+        self._basis = B
+        return B
 
     def lattice(self):
         """
         Return the associated subgroup of ZZ^2.
         """
-        return V.span(self.basis())
+        try:
+            return self._lattice
+        except AttributeError:
+            self._lattice = V.span(self.basis())
+            return self._lattice
 
     def index(self):
         """
@@ -107,7 +143,8 @@ class lattice:
         if self.rank()==0:
             return v==0
         c, d = v
-        return self.N.divides(c*self.d-d*self.c)
+        t = c*self._d-d*self._c
+        return t % self._N == 0 if self._N else t == 0
 
     def contains(self, other):
         """
@@ -128,23 +165,16 @@ class lattice:
         if self.is_trivial():
             return lattice(0,w)
         else:
-            return lattice(gcd(self.N, wedge(self.v(),w)), self.v())
+            return lattice(gcd(int(self.N), int(wedge(self.v(),w))), self.v())
 
     def __hash__(self):
-        return hash((self.N, self.c, self.d))
+        return hash(self._key)
 
     def __eq__(self,other):
-        if self.N!=other.N:
-            return False
-        if self.is_trivial():
-            return other.is_trivial()
-        if self.rank() != other.rank():
-            return False
-        # now both have the same rank 1 or 2
-        return other.contains1(self.v())
+        return self._key == other._key
 
     def __ne__(self,other):
-        return not self.__eq__(other)
+        return self._key != other._key
 
     def __lt__(self, other):
         # first compare ranks
@@ -170,6 +200,59 @@ class lattice:
 
 ############ end of definition of class lattice ##########################################################
 
+class LatticeSet:
+    r"""Class to store a list of rank 2 lattices which grows one lattice
+    at a time, together with:
+
+    ind_lcm, the lcm of the indices;
+
+    coverage, a bytearray of length #P1(ind_lcm) whose i'th entry is
+    nonzero iff P1(ind_lcm)[i] is in at least one of the lattices.
+
+    Both are updated as each lattice is added, so that testing whether
+    the lattices cover Z^2 does not need to start from scratch.  The
+    functions below which take a list of lattices also accept a
+    LatticeSet.
+    """
+    def __init__(self, LL=()):
+        self.items = []
+        self.ind_lcm = 1
+        self.coverage = bytearray(1)
+        for L in LL:
+            self.add(L)
+
+    def __repr__(self):
+        return f"LatticeSet({self.items})"
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def add(self, L):
+        """
+        Add one rank 2 lattice L
+        """
+        M = lcm(self.ind_lcm, L._N)
+        if M != self.ind_lcm:
+            self.coverage = covered_points(self.items, M)
+            self.ind_lcm = M
+        for i in containment_indices(M, L):
+            self.coverage[i] = 1
+        self.items.append(L)
+
+    def covers(self):
+        """
+        Return whether the lattices cover Z^2
+        """
+        return 0 not in self.coverage
+
+############ end of definition of class LatticeSet ##################################################
+
 def encode_lattice(L):
     """
     Convert an actual subgroup of ZZ^2 into a lattice
@@ -180,9 +263,21 @@ def encode_lattice(L):
     if L.rank()==1:
         return lattice(0, v)
     N = L.index_in(V)
-    if gcd(v)!=1:
-        A, _, U = L.basis_matrix().smith_form()
-        v = (U[1][1],-U[0][1])
+    if gcd(*v)!=1:
+        # Put the basis matrix into Hermite form [[g,b],[0,e]] with g*e=N:
+        (a, b), (c, d) = [[int(x) for x in w] for w in L.basis()]
+        g, x, y = xgcd(a, c)
+        g, b = int(g), int(x*b + y*d)
+        e = int(N) // g
+        # Since ZZ^2/L is cyclic, gcd(g,b,e)=1, and (g,b+e*t) is a
+        # primitive vector in L when t is the largest divisor of g
+        # coprime to b:
+        t = g
+        h = gcd(t, b)
+        while h!=1:
+            t //= h
+            h = gcd(t, h)
+        v = (g, b + e*t)
     return lattice(N,v)
 
 
@@ -204,7 +299,9 @@ def index_lcm(LL):
     """
     Return the lcm of of the indices of the L in LL
     """
-    return LCM(indices(LL))
+    if isinstance(LL, LatticeSet):
+        return LL.ind_lcm
+    return reduce(lcm, (int(L.N) for L in LL), 1)
 
 @cached_function
 def lattice_sort_key(L):
@@ -228,16 +325,45 @@ def is_in_union(v, LL):
     """
     return any(L.contains1(v) for L in LL)
 
+def containment_indices(N, L):
+    """
+    Return a tuple of the indices i such that P1(N)[i] lies in the
+    rank 2 lattice L, whose index must divide N.
+    """
+    return P1_fibres(N, L._N)[L.P1_index]
+
+def containment_mask(N, L):
+    """
+    Return an int whose i'th bit is set iff P1(N)[i] lies in the rank
+    2 lattice L, whose index must divide N.
+    """
+    return P1_fibre_masks(N, L._N)[L.P1_index]
+
+def covered_points(LL, N):
+    """
+    Return a bytearray of length #P1(N) whose i'th entry is nonzero
+    iff P1(N)[i] is in at least one of the lattices L in the list LL,
+    all of which must have rank 2 and index dividing N.
+    """
+    covered = bytearray(len(P1_ints(N)))
+    for L in LL:
+        for i in containment_indices(N, L):
+            covered[i] = 1
+    return covered
+
 def full_cover(N):
     """
     Return the full index N covering.
     """
-    return [lattice(N,v) for v in P1(N)]
+    return [lattice(N, c, d, _normalized=True) for c,d in P1_ints(N)]
 
 def isCover_rank2(LL, debug=False):
     """
     Given a list of rank 2 lattices, return whether they cover Z^2
     """
+    if isinstance(LL, LatticeSet):
+        return LL.covers()
+
     # Check the necessary condition that the weight is at least 1.
     # The empty list has weight 0.
 
@@ -246,12 +372,14 @@ def isCover_rank2(LL, debug=False):
 
     # Check that every v in P(N) lies in at least one, where N is the index lcm
     N = index_lcm(LL)
-    return all(is_in_union(v,LL) for v in P1(N))
+    return 0 not in covered_points(LL, N)
 
 def isCover(LL, debug=False):
     """
     Given a list of lattices, return whether they cover Z^2
     """
+    if isinstance(LL, LatticeSet):
+        return LL.covers()
     return isCover_rank2([L for L in LL if L.rank()==2])
 
 def isCover_without1(LL, i, debug=False):
@@ -271,12 +399,63 @@ def isFull(LL, check=False):
     """
     if check and not isCover(LL):
         return False
-    return (not any(L.rank()<2 for L in LL)) and (weight(LL)==1 or not any(isCover_without1(LL,i) for i in range(len(LL))))
+    if any(L.rank()<2 for L in LL):
+        return False
+    if weight(LL)==1:
+        return True
+
+    # Now LL is a covering by rank 2 lattices, and we check that it
+    # does not cover without LL[i] for each i, using the bitmasks of
+    # the points of P1(N) in each lattice, where N is the index lcm.
+    # This works since any N' divisible by all the indices of a list
+    # of lattices can be used to test if they cover.
+    N = index_lcm(LL)
+    all_points = (1 << len(P1_ints(N))) - 1
+    masks = [containment_mask(N, L) for L in LL]
+    # masks_after[i] is the union of masks[i:]
+    masks_after = [0]*(len(masks)+1)
+    for i in reversed(range(len(masks))):
+        masks_after[i] = masks_after[i+1] | masks[i]
+    masks_before = 0 # the union of masks[:i]
+    for i, mask in enumerate(masks):
+        if masks_before | masks_after[i+1] == all_points:
+            return False
+        masks_before |= mask
+    return True
+
+def _set_bits(mask):
+    """
+    Return the list of i such that the i'th bit of the int mask is set.
+    """
+    ans = []
+    while mask:
+        low = mask & -mask
+        ans.append(low.bit_length()-1)
+        mask ^= low
+    return ans
+
+def _isOneMinimal(M, L, others):
+    """
+    Return True iff L, one of a list of lattices which cover and whose
+    index lcm is M, cannot be replaced by a proper sublattice, given
+    the bitmask others of the points of P1(M) in the other lattices.
+    """
+    PM = P1_ints(M)
+    # any sublattice must contain all these:
+    S = [PM[i] for i in _set_bits(((1 << len(PM)) - 1) & ~others)]
+    nS = len(S)
+    if nS==0: # L is completely redundant
+        return False
+    v = S[0]
+    D = reduce(gcd, (int(wedge(v,w)) for w in S[1:]), M)
+    # the smallest lattice containing S is L(v;D)
+    return D==L.index()
 
 def isOneMinimal(LL, L):
     """
     Assuming that LL covers, and L in LL, return True iff L cannot be
-    replaced by a proper sublattice.
+    replaced by a proper sublattice.  The other lattices are those in
+    LL not equal to L.
     """
     # print(f"Checking {LL} for minimality w.r.t. {L}")
     # First a quick check on the weight: replacing L by a proper
@@ -287,27 +466,36 @@ def isOneMinimal(LL, L):
 
     # Now the full check.
     M = index_lcm(LL)
-    PM = P1(M)
-    # any sublattice must contain all these:
-    S = [v for v in PM if not any(L1!=L and L1.contains1(v) for L1 in LL)]
-    nS = len(S)
-    if nS==0: # L is completely redundant
-        return False
-    v = S[0]
-    D = GCD([M] + [wedge(v,w) for w in S[1:]])
-    # the smallest lattice containing S is L(v;D)
-    return D==L.index()
+    others = 0
+    for L1 in LL:
+        if L1!=L:
+            others |= containment_mask(M, L1)
+    return _isOneMinimal(M, L, others)
 
 def isMinimal(LL, check=False):
     """
-    Assuming that LL covers, return True iff LL is minimal.
+    Assuming that LL covers, return True iff LL is minimal, i.e. iff
+    isOneMinimal(LL, L) holds for all L in LL.  As there, the lattices
+    other than L exclude all those equal to L, so a repeated lattice is
+    not treated as redundant.
 
     If check is True, first check that LL covers.
     """
     # print(f"Checking {LL} for minimality")
     if check and not isCover(LL):
         return False
-    return all(isOneMinimal(LL,L) for L in LL)
+    # As in isOneMinimal() for each L in LL, but computing the points
+    # in the lattices other than L as those in at least two distinct
+    # lattices together with those in one lattice but not in L:
+    w = weight(LL)
+    M = index_lcm(LL)
+    masks = {L: containment_mask(M, L) for L in LL} # one for each distinct L
+    once = twice = 0
+    for mask in masks.values():
+        twice |= once & mask
+        once |= mask
+    return all(L.weight() > 2*(w-1) or _isOneMinimal(M, L, twice | (once & ~mask))
+               for L, mask in masks.items())
 
 def isStronglyMinimal(LL, check=False):
     """
@@ -317,7 +505,5 @@ def isStronglyMinimal(LL, check=False):
     """
     if weight(LL)!=1:
         return False
-    if check and not isCover(LL):
-        return False
-    return all(isOneMinimal(LL,L) for L in LL)
+    return isMinimal(LL, check)
 
@@ -1,6 +1,6 @@
 # pvg.py:  utilities for generating primitive vectors
 
-from sage.all import ZZ, QQ, FreeModule, cached_function, Gamma0, P1List
+from sage.all import ZZ, QQ, FreeModule, cached_function, P1List
 
 V = FreeModule(ZZ,2)
 TrivialModule = V.zero_submodule()
@@ -59,10 +59,58 @@ def primitive_vector_generator(skip=0):
 def P1(N):
     return P1List(N)
 
+# For the inner loops it is faster to iterate over pairs of Python ints:
+
+@cached_function
+def P1_ints(N):
+    """
+    Return the elements of P1(N) as a tuple of pairs (c,d) of Python ints.
+    """
+    return tuple((int(c), int(d)) for c,d in P1(N))
+
+@cached_function
+def P1_index_map(N):
+    """
+    Return a dict whose keys are the normalized pairs (c,d) in P1(N),
+    with value the index of (c,d) in P1(N).
+    """
+    return {cd: i for i,cd in enumerate(P1_ints(N))}
+
+@cached_function
+def P1_fibres(N, M):
+    """
+    For M dividing N, return a tuple whose j'th entry is the tuple of
+    indices i such that P1(N)[i] reduces to P1(M)[j] modulo M.
+
+    Since (c:d) in P1(N) lies in the lattice L(c':d';M) iff
+    (c:d)=(c':d') in P1(M), these are the points of P1(N) in each of
+    the lattices of index M.
+    """
+    P1M = P1(M)
+    fibres = [[] for _ in range(len(P1M))]
+    for i, (c,d) in enumerate(P1_ints(N)):
+        fibres[P1M.index(c,d)].append(i)
+    return tuple(tuple(f) for f in fibres)
+
+@cached_function
+def P1_fibre_masks(N, M):
+    """
+    The same as P1_fibres(N, M), but with each fibre encoded as an int
+    whose i'th bit is set iff i is in the fibre.
+    """
+    return tuple(sum(1 << i for i in f) for f in P1_fibres(N, M))
+
 @cached_function
 def psi(N):
     """
-    Return the value of psi(N) = #P(Z/NZ).
+    Return the value of psi(N) = #P(Z/NZ) = N*prod_{p|N}(1+1/p),
+    which is also the index of Gamma0(N) in SL(2,Z).
     """
-    return Gamma0(N).index() if N else 0
+    if not N:
+        return 0
+    N = ZZ(N)
+    ans = N
+    for p in N.prime_divisors():
+        ans = ans // p * (p+1)
+    return ans
 
@@ -1,7 +1,6 @@
-from sage.all import ZZ, deepcopy
 def refine_sequence(S, p, div=0, norepeats=True):
     """
-    S is a nested list of lists of indices, p a prime. Returns a list of refined lists S'
+    S is a nested list (or tuple) of lists of indices, p a prime. Returns a list of refined tuples S'
     obtained by replacing each integer N in S by either [N*p]*p or [N*p]*(p+1) depending
     on whether p|N or not.
 
@@ -10,42 +9,44 @@ def refine_sequence(S, p, div=0, norepeats=True):
 
     If norepeats is True, only make the substitutions for the first of each different entry in the sequence.
     """
+    # Singleton entries [x] are replaced by x, in S and in the
+    # refinements, as they are constructed, and list entries by tuples
+    # so that all the refinements consist of tuples:
+    S = [_as_tuples(Si[0] if isinstance(Si, (list, tuple)) and len(Si)==1 else Si) for Si in S]
     ans = []
     Si_done = []
     for i, Si in enumerate(S):
-        if Si not in ZZ and len(Si)==1:
-            Si=Si[0]
-        print(f"{p}-refining {Si} from {S}")
         if norepeats and Si in Si_done:
-            print(" - repeat, ignoring")
             continue
         Si_done.append(Si)
-        # Si is either an integer or another (possibly nested) list
-        if Si in ZZ:
+        # Si is either an integer or another (possibly nested) list.
+        # The new entries are tuples, which are never modified, so each
+        # refinement only needs a shallow copy of S (also a tuple).
+        # NB testing the type is much faster than testing Si in ZZ,
+        # which fails via an exception when Si is a list.
+        if not isinstance(Si, (list, tuple)):
             N = Si
-            if p.divides(N):
+            if N % p == 0:
                 if div>=0:
-                    copyS = deepcopy(S)
-                    copyS[i] = [p*N for _ in range(p)]
-                    #print(f"replaced {Si} with {copyS[i]}")
-                    ans.append(copyS)
+                    copyS = list(S)
+                    copyS[i] = (p*N,)*p
+                    ans.append(tuple(copyS))
             else:
                 if div<=0:
-                    copyS = deepcopy(S)
-                    copyS[i] = [p*N for _ in range(p+1)]
-                    #print(f"replaced {Si} with {copyS[i]}")
-                    #print(f"old S: {S}")
-                    #print(f"new S: {copyS}")
-                    ans.append(copyS)
+                    copyS = list(S)
+                    copyS[i] = (p*N,)*(p+1)
+                    ans.append(tuple(copyS))
         else: # Si is another list, use recursion
             for sub in refine_sequence(Si, p, div, norepeats):
-                copyS = deepcopy(S)
-                copyS[i] = sub
-                #print(f"replaced {Si} with {sub}")
-                ans.append(copyS)
-    for a in ans:
-        for i,ai in enumerate(a):
-            if ai not in ZZ and len(ai)==1:
-                a[i] = ai[0]
-    print(f"The {p}-refinements of {S} with {div=} are \n{ans}")
+                copyS = list(S)
+                copyS[i] = sub[0] if len(sub)==1 else sub
+                ans.append(tuple(copyS))
     return ans
+
+def _as_tuples(T):
+    """
+    Return T with all lists in it (at any depth) replaced by tuples.
+    """
+    if isinstance(T, (list, tuple)):
+        return tuple(_as_tuples(x) for x in T)
+    return T
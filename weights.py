@@ -4,12 +4,21 @@
 # which cannot come from a strongly minimal lattice covering as one or
 # more necessary conditions fail.
 
-from sage.all import Gamma0, srange, ZZ, gcd, lcm, cartesian_product_iterator, cached_function
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import combinations_with_replacement, product
+from math import gcd
+from sage.all import Gamma0, srange, ZZ, cached_function
 
 # An index list [N_1,...,N_n] satisfies the weight equation iff sum(1/psi(N_i))=1.
 
-@cached_function
 def psi(N):
+    # Looked up in the table _PSI for N<psimax (see below)
+    return _PSI[N] if 0<=N<psimax else _psi(N)
+
+@cached_function
+def _psi(N):
     return 1 if N==0 else Gamma0(N).index()
 
 # psi is not an increasing function, e.g. psi(6)=12, psi(7)=8.
@@ -19,12 +28,22 @@ def psi(N):
 # to psimax:
 
 psimax = 100
+
+# Tables of psi(N) for N<psimax, used by psi() and (as Python ints)
+# in the tests below:
+_PSI = [ZZ(_psi(N)) for N in range(psimax)]
+PSI_TAB = [int(M) for M in _PSI]
+
 psi_inv_tab = dict([(x,[]) for x in srange(psimax)])
 for N in srange(1,psimax):
-    psiN = psi(N)
+    psiN = PSI_TAB[N]
     if psiN<psimax:
         psi_inv_tab[psiN].append(N)
 
+# The values of psi up to psimax in increasing order, and their preimages:
+PSI_VALUES = [M for M in range(1,psimax) if psi_inv_tab[M]]
+PSI_INV = {M: tuple(psi_inv_tab[M]) for M in PSI_VALUES}
+
 
 # Given $n$, find all $N_1\le N_2\le\dots\le N_n$ with $\sum_{i=1}^{n}\frac{1}{\psi(N_i)}=1$.
 
@@ -32,9 +51,11 @@ for N in srange(1,psimax):
 # solutions in N_i by using the lookup table to replace each M_i with
 # one or more solutions N_i to psi(N_i)=M_i.
 
-def solve_weights(n, total, minpsi, strong=True, debug=False):
+def solve_weights(n, num, den, minpsi, strong=True, debug=False):
     """Returns a list of weakly increasing lists of n values of psi(N)
-    satisfying sum(psi(N))=total, with all values >=minpsi.
+    satisfying sum(1/psi(N))=total, with all values >=minpsi, where
+    total=num/den is given by two integers (in lowest terms) to avoid
+    rational arithmetic.
 
     'strong' is not used (always True) at present.
 
@@ -46,17 +67,30 @@ def solve_weights(n, total, minpsi, strong=True, debug=False):
     arbitrary positive integers M_i.  All we do that is special here
     is to ignore any M which are not values of psi, as determined from
     the lookup table.
+
+    The results are cached (except when debug is True), since the same
+    subproblems arise many times in the recursion.
     """
     if debug:
-        print(f"In solve_weights() with {n=}, {total=}, {minpsi=}")
-    if n==0 or (strong and total<=0):
-        return []
+        return [list(s) for s in _solve_weights(n, num, den, minpsi, strong, debug)]
+    return [list(s) for s in _solve_weights_cached(n, num, den, minpsi, strong)]
+
+@lru_cache(maxsize=None)
+def _solve_weights_cached(n, num, den, minpsi, strong):
+    return _solve_weights(n, num, den, minpsi, strong)
+
+def _solve_weights(n, num, den, minpsi, strong=True, debug=False):
+    # solve_weights() returning a tuple of tuples
+    if debug:
+        print(f"In solve_weights() with {n=}, total={num}/{den}, {minpsi=}")
+    if n==0 or (strong and num<=0):
+        return ()
     ans = []
-    for psiN in srange(minpsi,psimax):
-        if not psi_inv_tab[psiN]:
-            continue
-        # We require 1/psiN <= total; if equal and n==1 then one solution, otherwise recurse:
-        t = psiN*total-n
+    # We require 1/psiN <= total, i.e. psiN >= den/num:
+    start = max(minpsi, -(-den//num)) if num>0 else minpsi
+    for psiN in PSI_VALUES[bisect_left(PSI_VALUES, start):]:
+        # if 1/psiN = total/n then one solution, otherwise recurse:
+        t = psiN*num-n*den
         if t > 0:
             break
         if debug:
@@ -64,20 +98,27 @@ def solve_weights(n, total, minpsi, strong=True, debug=False):
         if t == 0:
             if debug:
                 print(f" - {psiN=} fits exactly ({n} times)")
-            ans.append([psiN]*n)
+            ans.append((psiN,)*n)
         else: # t<0
             if n==1:
                 continue
             if debug:
                 print(f" - {psiN=} fits, using recursion for the rest")
-            tails = solve_weights(n-1,total-ZZ(1)/psiN, psiN, strong, debug)
+            # new_total = total-1/psiN:
+            new_num = num*psiN-den
+            new_den = den*psiN
+            g = gcd(new_num, new_den)
+            if debug:
+                tails = _solve_weights(n-1, new_num//g, new_den//g, psiN, strong, debug)
+            else:
+                tails = _solve_weights_cached(n-1, new_num//g, new_den//g, psiN, strong)
             if debug:
                 print(f" - recursion returns {tails}")
             for tail in tails:
-                ans.append([psiN]+tail)
+                ans.append((psiN,)+tail)
     if debug:
-        print(f"*** solve_weights() with {n=}, {total=}, {minpsi=} returns {ans}")
-    return ans
+        print(f"*** solve_weights() with {n=}, total={num}/{den}, {minpsi=} returns {ans}")
+    return tuple(ans)
 
 def Nlist_from_psiNlist(psis, debug=False):
     """
@@ -85,53 +126,192 @@ def Nlist_from_psiNlist(psis, debug=False):
     """
     if debug:
         print(f"List of psi(N): {psis}")
-    Ns = [psi_inv_tab[x] for x in psis]
-    if debug:
-        print(f"List of lists of N: {Ns}")
-    if not all(y for y in Ns):
-        return []
-    allNs = list(cartesian_product_iterator(Ns))
+        print(f"List of lists of N: {[PSI_INV.get(x, ()) for x in psis]}")
+    allNs = list(_expand(tuple(psis)))
     if debug:
         print(f"List of lists of N: {allNs}")
     return allNs
 
+@lru_cache(maxsize=None)
+def _expand(psis):
+    # Nlist_from_psiNlist() for a tuple psis, as a tuple of tuples.
+    # If some x is not a value of psi the product is empty, so there
+    # is no need to test for this separately.
+    return tuple(product(*(PSI_INV.get(x, ()) for x in psis)))
+
+
+def _has_coprime_pair(Nlist):
+    """
+    Return True iff gcd(N1,N2)==1 for some N1, N2 in Nlist (not
+    necessarily distinct, so this is True if 1 is in Nlist).
+    """
+    Ns = sorted(set(Nlist))
+    if Ns and Ns[0]==1:
+        return True
+    # Only pairs of distinct values need to be tested:
+    for i, N1 in enumerate(Ns):
+        for N2 in Ns[i+1:]:
+            if gcd(N1,N2)==1:
+                return True
+    return False
+
+@lru_cache(maxsize=None)
+def _primes_of(N):
+    # The prime divisors of N, as a tuple of ints
+    return tuple(int(p) for p in ZZ(N).prime_divisors())
+
+# Each of the following rules is a tuple (rule, pred, excl, d) where
+# pred is a condition on the counts of the small indices in Nlist.  If
+# pred holds then Nlist is ruled out unless all the indices not in
+# excl are multiples of d, with no two of their cofactors coprime.
+
+SPECIAL_RULES = [
+    # (5) [2,2,4,...] and [2,4,4,4,...]
+    ("(5)", lambda c: (c[2]==2 and c[4]==1) or (c[2]==1 and c[4]==3), (2,4), 4),
+    # (6) [2,4,4,...]
+    ("(6)", lambda c: c[2]==1 and c[4]==2, (2,4), 2),
+    # (7) [2,2,6,6,6,...] and [2,4,4,6,6,6,...]
+    ("(7)", lambda c: c[2]==2 and c[6]==3, (2,6), 6),
+    ("(7)", lambda c: c[2]==1 and c[4]==2 and c[6]==3, (2,4,6), 6),
+    # (8) [3,3,3,6,6,...]
+    ("(8)", lambda c: c[3]==3 and c[6]==2, (3,6), 6),
+    # (9) [3,3,6,6,6,6,...]
+    ("(9)", lambda c: c[3]==2 and c[6]>=4, (3,6), 6),
+]
+
+def _extendable(Ns, N, m, strong=True):
+    """
+    Return False if the partial index list Ns (which includes the new
+    entry N) cannot be extended by m more indices to one passing tests
+    (2) and (3)(a) of is_valid_Nlist().
+    """
+    if strong and any(gcd(N, N1)==1 for N1 in Ns):
+        return False
+    for p in set().union(*(_primes_of(N1) for N1 in Ns)):
+        if sum(N1%p==0 for N1 in Ns) + m <= p:
+            return False
+    return True
+
+def _insert(Ns, N):
+    # The sorted tuple Ns with N inserted
+    i = bisect_right(Ns, N)
+    return Ns[:i] + (N,) + Ns[i:]
+
+def solve_Nlists(n, num, den, minpsi, Ns=(), last=0, strong=True, debug=False):
+    """Generates the sorted tuples of indices N, extending the sorted
+    partial list Ns by n more, satisfying sum(1/psi(N))=total, with all psi(N)>=minpsi,
+    where total=num/den as in solve_weights().
+
+    This follows the same recursion as solve_weights(), but chooses
+    each N as soon as its value of psi is chosen, so that partial lists
+    which cannot pass the coprimality test (2) or test (3)(a) of
+    is_valid_Nlist() are discarded before they are completed.  The new
+    entries are chosen in order of psi(N) and then of N, starting after
+    last (the most recently chosen N), so each list of indices occurs
+    only once.
+
+    Since this is a generator, the tuples are produced one at a time
+    and never all held in memory at once.
+    """
+    if debug:
+        print(f"In solve_Nlists() with {n=}, total={num}/{den}, {minpsi=}, {Ns=}, {last=}")
+    if n==0 or (strong and num<=0):
+        return
+    start = max(minpsi, -(-den//num)) if num>0 else minpsi
+    for psiN in PSI_VALUES[bisect_left(PSI_VALUES, start):]:
+        t = psiN*num-n*den
+        if t > 0:
+            break
+        if t < 0 and n==1:
+            continue
+        # keep the N with the same psi(N) in increasing order:
+        Nmin = last if PSI_TAB[last]==psiN else 0
+        if t == 0: # the remaining n indices all have psi(N)=psiN
+            for tail in combinations_with_replacement([N for N in PSI_INV[psiN] if N>=Nmin], n):
+                Ns1 = Ns
+                for N in tail:
+                    Ns1 = _insert(Ns1, N)
+                yield Ns1
+            continue
+        new_num = num*psiN-den
+        new_den = den*psiN
+        g = gcd(new_num, new_den)
+        for N in PSI_INV[psiN]:
+            if N<Nmin:
+                continue
+            Ns1 = _insert(Ns, N)
+            if _extendable(Ns1, N, n-1, strong):
+                yield from solve_Nlists(n-1, new_num//g, new_den//g, psiN, Ns1, N, strong, debug)
 
-def is_valid_Nlist(Nlist, strong=True, debug=False):
+def is_valid_Nlist(Nlist, strong=True, debug=False, skip_weight=False):
     """
     Test a list Nlist of indices N for validity as an index sequence
     for a strongly minimal covering. This is not a complete test yet,
     we just impose some necessary condictions.  These suffice for
     n<=8.
+
+    If skip_weight is True, the weight (in)equality is assumed to hold
+    and is not checked (e.g. when Nlist came from solve_weights()).
+
+    The result only depends on Nlist up to order, and is cached
+    (except when debug is True).
     """
+    Nlist = tuple(sorted(Nlist))
     if debug:
-        print(f"Checking validity of {Nlist} ({strong=})")
+        return _is_valid_Nlist(Nlist, strong, skip_weight, debug)
+    return _is_valid_Nlist_cached(Nlist, strong, skip_weight)
 
-    # (1) check the weight (in)equality holds:
-    wt = sum((ZZ(1)/psi(N) for N in Nlist))
-    if not (wt==1 if strong else wt>=1):
-        if debug:
-            print("weight condition fails")
-        return False
+@lru_cache(maxsize=None)
+def _is_valid_Nlist_cached(Nlist, strong, skip_weight):
+    return _is_valid_Nlist(Nlist, strong, skip_weight)
+
+def _is_valid_Nlist(Nlist, strong=True, skip_weight=False, debug=False):
+    # Nlist is a sorted tuple, see is_valid_Nlist()
     if debug:
-        print("weight condition passes")
+        print(f"Checking validity of {list(Nlist)} ({strong=})")
+    count = Counter(Nlist)
+    # The tests below which scan the indices only need to look at each
+    # distinct index once, using count for multiplicities:
+    Ns = sorted(count)
 
-    # (2) in the strong case, make sure that no two indices are coprime:
-    if strong:
-        if any((gcd(N1,N2)==1 for N1 in Nlist for N2 in Nlist)):
+    # (1) check the weight (in)equality holds:
+    if not skip_weight:
+        # sum(1/m for m in ms) is S/P where P=prod(ms), S=sum(P/m):
+        ms = [PSI_TAB[N] if N<psimax else int(psi(N)) for N in Nlist]
+        P = 1
+        for m in ms:
+            P *= m
+        S = sum(P//m for m in ms)
+        if not (S==P if strong else S>=P):
             if debug:
-                print("NO: there are coprime indices")
+                print("weight condition fails")
             return False
         if debug:
-            print("OK: no coprime indices")
-
-    # (3) various tests for each prime p dividing any index
-    supp = lcm(Nlist).support()
-    for p in supp:
+            print("weight condition passes")
+
+    # (3) various tests for each prime p dividing any index.  We find
+    # these primes (the support of the lcm of the indices, but without
+    # factoring the lcm) and, for each p, the distinct indices which p
+    # divides, from the cached prime divisors of each index:
+    pNss = defaultdict(list)
+    for N in Ns:
+        for p in _primes_of(N):
+            pNss[p].append(N)
+    supp = sorted(pNss)
+
+    # Test (3)(a) below must fail for any p>=len(Nlist), since at most
+    # len(Nlist) indices are divisible by p, so we check the largest
+    # prime first:
+    if supp and supp[-1]>=len(Nlist):
         if debug:
-            print(f"{p=}:")
+            print(f"NO: fewer than {supp[-1]+1} terms are divisible by {supp[-1]}")
+        return False
 
-        # (3)(a) Check that we have at least p+1 lattices with p|index:
-        Np = sum(N%p==0 for N in Nlist)
+    # (3)(a) Check that we have at least p+1 lattices with p|index.
+    # This is cheap and rejects most lists, so is done for all p
+    # (smallest first) before test (2) and the rest of (3):
+    for p in supp:
+        Np = sum(count[N] for N in pNss[p])
         if Np<=p:
             if debug:
                 print(f"NO: only {Np} terms are divisible by {p}")
@@ -139,16 +319,26 @@ def is_valid_Nlist(Nlist, strong=True, debug=False):
         if debug:
             print(f"OK: {Np} terms are divisible by {p}")
 
-        # (3)(b) If strong and we have p lattices of index p,
-        # check that we have no two indices p*m,p*n with m,n coprime:
-        if strong:
-            if Nlist.count(p)==p:
+    # (2) in the strong case, make sure that no two indices are coprime:
+    if strong:
+        if _has_coprime_pair(Ns):
+            if debug:
+                print("NO: there are coprime indices")
+            return False
+        if debug:
+            print("OK: no coprime indices")
+
+    # (3)(b) If strong and we have p lattices of index p,
+    # check that we have no two indices p*m,p*n with m,n coprime:
+    if strong:
+        for p in supp:
+            if count[p]==p:
                 if debug:
                     print(f"{p} terms are equal to {p}")
-                pNlist = [N//p for N in Nlist if N%p==0 and N!=p]
+                pNlist = [N//p for N in pNss[p] if N!=p]
                 if debug:
                     print(f"Other terms divisible by {p} have cofactors {pNlist}")
-                if any((gcd(N1,N2)==1 for N1 in pNlist for N2 in pNlist)):
+                if _has_coprime_pair(pNlist):
                     return False
                 if debug:
                     print("OK")
@@ -157,73 +347,24 @@ def is_valid_Nlist(Nlist, strong=True, debug=False):
     if not strong:
         return True
 
-    N2 = Nlist.count(2)
-    N3 = Nlist.count(3)
-    N4 = Nlist.count(4)
-    N6 = Nlist.count(6)
-
     # (4) Rule out [2,4,6,...] with more than four 6s
-    if N2 and N4 and N6>4:
+    if count[2] and count[4] and count[6]>4:
         if debug:
             print("NO: 2,4 and more than four 6s")
         return False
 
-    # (5) Rule out [2,2,4,...] and [2,4,4,4,...] if not all the rest are multiples of 4,
-    # or they are, but two cofactors are coprime:
-    if (N2==2 and N4==1) or (N2==1 and N4==3):
-        Nlist2 = [N for N in Nlist if N!=2 and N!=4]
-        if not all(N%4==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//4 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
-
-    # (6) Rule out [2,4,4,...] if not all the rest are multiples of 2,
-    # or they are, but two cofactors are coprime:
-    if (N2==1 and N4==2):
-        Nlist2 = [N for N in Nlist if N!=2 and N!=4]
-        if not all(N%2==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//2 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
-
-    # (7) Rule out [2,2,6,6,6,...] or [2,4,4,6,6,6,...] if not all the rest are multiples of 6,
-    # or they are, but two cofactors are coprime:
-    if (N2==2 and N6==3):
-        Nlist2 = [N for N in Nlist if N!=2 and N!=6]
-        if not all(N%6==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//6 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
-    if (N2==1 and N4==2 and N6==3):
-        Nlist2 = [N for N in Nlist if N!=2 and N!=4 and N!=6]
-        if not all(N%6==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//6 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
-
-    # (8) Rule out [3,3,3,6,6,6,...] if not all the rest are multiples of 6,
-    # or they are, but two cofactors are coprime:
-    if (N3==3 and N6==2):
-        Nlist2 = [N for N in Nlist if N!=3 and N!=6]
-        if not all(N%6==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//6 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
-
-    # (9) Rule out [3,3,6,6,6,6,...] if not all the rest are multiples of 6,
-    # or they are, but two cofactors are coprime:
-    if (N3==2 and N6>=4):
-        Nlist2 = [N for N in Nlist if N!=3 and N!=6]
-        if not all(N%6==0 for N in Nlist2):
-            return False
-        Nlist2m = [N//6 for N in Nlist2]
-        if any((gcd(N1,N2)==1 for N1 in Nlist2m for N2 in Nlist2m)):
-            return False
+    # (5)-(9) see SPECIAL_RULES
+    for rule, pred, excl, d in SPECIAL_RULES:
+        if pred(count):
+            Nlist2 = [N for N in Ns if N not in excl]
+            if not all(N%d==0 for N in Nlist2):
+                if debug:
+                    print(f"NO: rule {rule} applies and not all other terms are multiples of {d}")
+                return False
+            if _has_coprime_pair([N//d for N in Nlist2]):
+                if debug:
+                    print(f"NO: rule {rule} applies and two cofactors are coprime")
+                return False
 
     return True
 
@@ -235,15 +376,31 @@ def all_index_sequences(n, strong=True, debug=False):
 
     'strong' is redundant (always True, the nonstrong case is not implemented).
 
-    (1) Use solve_weights() to find a list of all lists [M1,M2,...,Mn]
-    where each Mi is a value of psi, satisfying the weight equation
-    sum(1/Mi)=1.
+    (1) Use solve_Nlists() to find a list of all lists [N1,...,Nn]
+    satisfying sum(1/psi(Ni))=1, following the solutions [M1,...,Mn]
+    of sum(1/Mi)=1 with each Mi a value of psi, as in solve_weights().
 
-    (2) Hence find a list of all lists [N1,...,Nn] satisfying sum(1/psi(Ni))=1.
+    (2) Discard partial lists as soon as they cannot pass some of the
+    tests in is_valid_Nlist().
 
     (3) Use is_valid_Nlist() to discard any which fail to satisfy one of several necessary conditions.
 
+    The sequences are returned in lexicographic order.
+
+    The result is cached (except when debug is True), so repeated calls
+    with the same n are fast.
     """
+    if debug:
+        return _all_index_sequences(n, strong, debug)
+    return [list(s) for s in _all_index_sequences_cached(n, strong)]
+
+@lru_cache(maxsize=None)
+def _all_index_sequences_cached(n, strong):
+    return tuple(tuple(s) for s in _all_index_sequences(n, strong))
+
+def _all_index_sequences(n, strong=True, debug=False):
+    # all_index_sequences() without caching
+
     # For n=1,2,3 we just write down the knwon solutions.
     if n==1:
         return [[1]]
@@ -252,20 +409,25 @@ def all_index_sequences(n, strong=True, debug=False):
     if n==3:
         return [[2,2,2]]
 
-    # Now n>=4. Use the recursive function to find integer solutions of length n, total 1, all psi(N)>=3:
-    psiNlist = solve_weights(n, total=1, minpsi=3, strong=True, debug=debug)
-
-    # Now replace each psiN in each list with all possible N with that value of psi(N)
-    Nlists = sum((Nlist_from_psiNlist(s) for s in psiNlist), [])
+    # Now n>=4. Use the recursive function to find all lists of n
+    # indices N with total weight 1 and all psi(N)>=3, omitting those
+    # which already fail some of the tests in is_valid_Nlist():
+    Nlists = solve_Nlists(n, num=1, den=1, minpsi=3, strong=True, debug=debug)
     if debug:
+        Nlists = list(Nlists)
         print(f"Before validity check there are {len(Nlists)} solutions")
 
-    # Finally weed out any which fail our tests:
+    # Finally weed out any which fail our tests (the weight condition
+    # holds by construction, and each list occurs only once and is
+    # already sorted):
     ans = []
     for Nlist in Nlists:
-        s = sorted(Nlist)
-        if s not in ans and is_valid_Nlist(s, debug=False):
-            ans.append(s)
+        if _is_valid_Nlist(Nlist, skip_weight=True):
+            ans.append(list(Nlist))
+    ans.sort()
     if debug:
         print(f"After validity check and removal of repeats there are {len(ans)} solutions")
     return ans
+
+# Same interface as for a Sage cached_function:
+all_index_sequences.clear_cache = _all_index_sequences_cached.cache_clear